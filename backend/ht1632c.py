@@ -46,8 +46,9 @@ import time
 import spidev
 import logging
 import numpy as np
-from scipy.ndimage.interpolation import shift
-from threading import Thread, Lock
+from numpy.lib.stride_tricks import as_strided
+from threading import Thread, Lock, Event
+from collections import OrderedDict
 from datetime import datetime
 import re
 
@@ -69,15 +70,13 @@ class ScrollingMessage(Thread):
     Use to scroll specified message until end of thread
     """
 
-    def __init__(self, board_size, message_length, buf, buf_index, direction, speed, write_pixels_callback, reset_callback):
+    def __init__(self, board_size, buf, direction, speed, write_pixels_callback, reset_callback):
         """
         Constructor
 
         Args:
             board_size (int): board size
-            message_length (int): message length
-            buf () : buffer
-            buf_index (int): buffer index
+            buf (numpy.ndarray): message buffer, surrounded by board_size empty columns on both sides
             direction (int): scroll direction
             speed (float): message speed (pause between each step)
             write_pixels_callback (function): write pixel callback
@@ -90,53 +89,49 @@ class ScrollingMessage(Thread):
 
         #members
         self.board_size = board_size
-        self.message_length = message_length
         self.buf = buf
-        self.buf_index = buf_index
         self.direction = direction
         self.speed = speed
         self.write_pixels = write_pixels_callback
         self.reset = reset_callback
-        self.__continu = True
+        self.__stop_event = Event()
+
+        #precompute all scrolling frames: each row is a board sized window over buffer (view, no copy)
+        #frames are read-only: buffer is never modified while scrolling so it never needs to be copied
+        self.frames = as_strided(buf, shape=(len(buf)-board_size+1, board_size), strides=(buf.strides[0], buf.strides[0]), writeable=False)
 
     def stop(self):
         """
         Stop scrolling message
         """
-        self.__continu = False
+        self.__stop_event.set()
 
     def run(self):
         """
         Scrolling message process
         """
-        while self.__continu:
-            try:
-                #make buffer copy
-                copy = np.copy(self.buf)
+        #left to right scrolling walks frames backward
+        if self.direction==0:
+            indexes = range(len(self.frames)-1, -1, -1)
+        else:
+            indexes = range(len(self.frames))
 
-                #compute max scrolling position
-                max_scrolling = self.board_size + self.message_length
+        #bind values used for each frame to locals
+        speed = float(self.speed)
+        frames = self.frames
+        write_pixels = self.write_pixels
+        wait = self.__stop_event.wait
 
+        while not self.__stop_event.is_set():
+            try:
                 #scroll message to board
-                while max_scrolling>=0 and self.__continu:
+                for index in indexes:
                     #display message
-                    self.write_pixels(copy, self.buf_index)
-
-                    #shift buffer content
-                    if self.direction==0:
-                        copy = shift(copy, 1, cval=0)
-                    else:
-                        copy = shift(copy, -1, cval=0)
-
-                    #decrease number of scroll to process
-                    max_scrolling -= 1
-
-                    #pause
-                    time.sleep(float(self.speed))
+                    write_pixels(frames[index], 0)
 
-                #force buffer deletion
-                del copy
-                copy = None
+                    #pause (interrupted as soon as scrolling is stopped)
+                    if wait(speed):
+                        break
 
                 #auto reset hardware if needed
                 self.reset()
@@ -325,7 +320,21 @@ FONT5x7 = [
     [0x00,0x40,0xA0,0x40,0x00] #
 ]
 
-FONT_INVALID = [0x28,0xfe,0x28,0xfe,0x28] # '#'
+FONT_INVALID = ord('#')
+FONT_WIDTH = 5
+
+#font as contiguous lookup tables built once at import: glyphs columns and glyphs width (0 for invalid char)
+#invalid chars glyph is filled with invalid char glyph
+FONT5x7_GLYPHS = np.zeros((256, FONT_WIDTH), dtype=np.uint8)
+FONT5x7_WIDTHS = np.zeros((256,), dtype=np.uint8)
+for _code, _glyph in enumerate(FONT5x7):
+    FONT5x7_GLYPHS[_code, :len(_glyph)] = _glyph
+    FONT5x7_WIDTHS[_code] = len(_glyph)
+del _code, _glyph
+FONT5x7_GLYPHS[FONT5x7_WIDTHS==0] = FONT5x7_GLYPHS[FONT_INVALID]
+#tables are shared by all boards, protect them
+FONT5x7_GLYPHS.setflags(write=False)
+FONT5x7_WIDTHS.setflags(write=False)
 
 LOGOS = {
     #smileys
@@ -359,7 +368,63 @@ LOGOS = {
     ':snowy': [0x32,0x4d,0x8a,0x8d,0x8a,0x6d,0x2a,0x2d,0x10],
     ':night': [0x3c,0x42,0x99,0xa5,0xc3,0x42]
 }
+#logos as uint8 arrays to copy them at once (read-only, shared by all boards)
+LOGOS_GLYPHS = {logo: np.asarray(columns, dtype=np.uint8) for logo, columns in LOGOS.items()}
+for _glyph in LOGOS_GLYPHS.values():
+    _glyph.setflags(write=False)
+del _glyph
 PATTERN_REPLACEMENT = '^'
+PATTERN_LOGO = 0
+PATTERN_TEXT = 1
+#logos (longest first to match them before shorter ones) or time pattern with optional timestamp
+PATTERN_RE = re.compile(u'(%s)|(:time)(:[0-9]+)?' % u'|'.join(re.escape(logo) for logo in sorted(LOGOS, key=len, reverse=True)))
+
+def _rasterize_plain(text):
+    """
+    Rasterize plain text (without pattern) in a single font table lookup
+
+    Args:
+        text (unicode): text to rasterize. PATTERN_REPLACEMENT chars are skipped
+
+    Returns:
+        numpy.ndarray: text pixels (uint8)
+    """
+    text = text.replace(PATTERN_REPLACEMENT, u'')
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+    codes = np.where(codes<256, codes, FONT_INVALID)
+    return FONT5x7_GLYPHS[codes].ravel()
+
+#pattern rasterizer by pattern kind
+PATTERN_RASTERIZERS = {
+    PATTERN_LOGO: LOGOS_GLYPHS.__getitem__,
+    PATTERN_TEXT: _rasterize_plain,
+}
+
+#index of next column of each panel column (panels are always 32 columns wide)
+NEXT_COLUMNS = (np.arange(32) + 1) & 31
+
+def _encode_panels(pixels, out, scratch):
+    """
+    Encode all panels pixels into HT1632C write RAM buffers
+    All operations are done in place in preallocated buffers
+
+    Args:
+        pixels (numpy.ndarray): panels pixels (uint8) with shape (panel_count, 32)
+        out (numpy.ndarray): panels output buffers with shape (panel_count, 34). Command part (out[:,0]) is not filled
+        scratch (numpy.ndarray): work buffer (uint8) with shape (panel_count, 32)
+
+    Returns:
+        numpy.ndarray: data part of output buffers
+    """
+    out[:, 1] = (0x3F & pixels[:, 0]) >> 2
+    body = out[:, 2:]
+    #2 lowest bits of current column as highest bits (uint8 shift drops other bits)
+    np.left_shift(pixels, 6, out=body)
+    #6 highest bits of next column as lowest bits
+    np.take(pixels, NEXT_COLUMNS, axis=1, out=scratch)
+    np.right_shift(scratch, 2, out=scratch)
+    np.bitwise_or(body, scratch, out=body)
+    return body
 
 class HT1632C():
     """
@@ -405,6 +470,17 @@ class HT1632C():
 
     RESET_HW_DELAY = 60
 
+    RUNS_CACHE_SIZE = 128
+
+    #A0, A1, A2 mux states to select each panel
+    PANELS_SELECT = [
+        (GPIO.LOW, GPIO.LOW, GPIO.LOW),
+        (GPIO.HIGH, GPIO.LOW, GPIO.LOW),
+        (GPIO.LOW, GPIO.HIGH, GPIO.LOW),
+        (GPIO.HIGH, GPIO.HIGH, GPIO.LOW),
+    ]
+    PANELS_UNSELECT = (GPIO.HIGH, GPIO.HIGH, GPIO.HIGH)
+
     def __init__(self, pin_a0, pin_a1, pin_a2, pin_e3, panel_count):
         """
         Constructor
@@ -425,7 +501,9 @@ class HT1632C():
         self.__pin_a1 = pin_a1
         self.__pin_a2 = pin_a2
         self.__pin_e3 = pin_e3
+        self.__pins_select = [pin_a0, pin_a1, pin_a2]
         self.__panel_count = panel_count
+        self.__board_size = panel_count * 32
         self.__scrolling_thread = None
         self.speed = 0.05
         self.direction = HT1632C.SCROLL_RIGHT_TO_LEFT
@@ -434,7 +512,15 @@ class HT1632C():
         self.unit_minutes = u'mins'
         self.__turned_on = True
         self.__last_hw_reset = None
-        self.__panel_cleared = {}
+        self.__panel_cleared = [False] * panel_count
+        self.__runs_cache = OrderedDict()
+        self.__panels_buf = np.zeros((panel_count, 34), dtype=np.uint8)
+        self.__panels_buf[:, 0] = (HT1632C.HT1632_ID_WR << 5) & 0xE0
+        self.__panels_scratch = np.zeros((panel_count, 32), dtype=np.uint8)
+        self.__frame_buf = np.zeros((4 * self.__board_size,), dtype=np.uint8)
+        self.__empty_board = np.zeros((self.__board_size,), dtype=np.uint8)
+        self.__random_state = np.random.RandomState()
+        self.__random_buf = np.empty((self.__board_size,), dtype=np.uint8)
 
         #configure gpios
         GPIO.setmode(GPIO.BOARD)
@@ -455,6 +541,8 @@ class HT1632C():
         self.__spi = spidev.SpiDev(0, 0)
         self.__spi.max_speed_hz = 976000
         self.__spi.mode = 3
+        #writebytes2 (spidev>=3.4) sends buffer without converting it to list
+        self.__spi_has_writebytes2 = hasattr(self.__spi, u'writebytes2')
 
         #configure panels
         for panel in range(self.__panel_count):
@@ -548,8 +636,8 @@ class HT1632C():
         if self.__scrolling_thread!=None:
             self.logger.debug(u'Stop scrolling thread')
             self.__scrolling_thread.stop()
-            #self.__scrolling_thread.join(1.0)
-            time.sleep(0.25)
+            #thread exits as soon as current frame is written
+            self.__scrolling_thread.join(1.0)
             self.__scrolling_thread = None
             
     def __select_panel(self, panel):
@@ -560,32 +648,15 @@ class HT1632C():
         Args:
             panel (int): panel number
         """
-        if panel==0:
-            GPIO.output(self.__pin_a0, GPIO.LOW)
-            GPIO.output(self.__pin_a1, GPIO.LOW)
-            GPIO.output(self.__pin_a2, GPIO.LOW)
-            #time.sleep(0.001)
-        elif panel==1:
-            GPIO.output(self.__pin_a0, GPIO.HIGH)
-            GPIO.output(self.__pin_a1, GPIO.LOW)
-            GPIO.output(self.__pin_a2, GPIO.LOW)
-            #time.sleep(0.001)
-        elif panel==2:
-            GPIO.output(self.__pin_a0, GPIO.LOW)
-            GPIO.output(self.__pin_a1, GPIO.HIGH)
-            GPIO.output(self.__pin_a2, GPIO.LOW)
-            #time.sleep(0.001)
-        elif panel==3:
-            GPIO.output(self.__pin_a0, GPIO.HIGH)
-            GPIO.output(self.__pin_a1, GPIO.HIGH)
-            GPIO.output(self.__pin_a2, GPIO.LOW)
-            #time.sleep(0.001)
+        if panel is not None and 0<=panel<len(HT1632C.PANELS_SELECT):
+            states = HT1632C.PANELS_SELECT[panel]
         else:
-            GPIO.output(self.__pin_a0, GPIO.HIGH)
-            GPIO.output(self.__pin_a1, GPIO.HIGH)
-            GPIO.output(self.__pin_a2, GPIO.HIGH)
             #panel unselect doesn't need to pause system
             #because we don't need to sync gpio and spi
+            states = HT1632C.PANELS_UNSELECT
+
+        #update all mux pins at once
+        GPIO.output(self.__pins_select, states)
 
     def __write_command_to_panel(self, panel, command):
         """
@@ -598,61 +669,60 @@ class HT1632C():
         #prepare command
         buf = [(HT1632C.HT1632_ID_CMD << 5) | (command >> 3), (command << 5)]
         
-        #select panel to send command to
-        self.__lock.acquire(True)
-        self.__select_panel(panel)
+        with self.__lock:
+            #select panel to send command to
+            self.__select_panel(panel)
 
-        #write command and read result
-        res = self.__spi.writebytes(buf)
-        
-        #unselect panel
-        self.__select_panel(None)
-        self.__lock.release()
+            #write command and read result
+            res = self.__spi.writebytes(buf)
+
+            #unselect panel
+            self.__select_panel(None)
         
         return res
 
-    def __write_pixels_to_panel(self, panel, pixels):
+    def __write_all_panels(self, pixels):
         """
-        Write pixels buffer to specified panel
-        
+        Write pixels buffer to all panels
+        All panels are encoded at once and sent during a single lock acquisition
+
         Args:
-            panel: panel number
-            pixels: pixels buffer
+            pixels: panels pixels buffer with shape (panel_count, 32)
         """
-        #prepare buffer
-        buf =  [(HT1632C.HT1632_ID_WR << 5) & 0xE0, ((0x3F & pixels[0]) >> 2),
-                    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-                    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-                    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-                    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-        for i in range(32):
-            buf[i+2] = ((pixels[i] << 6) & 0xC0) | ((pixels[(i+1) % 32] >> 2) & 0x3F)
-
-        #check buffer
-        non_zeros = np.count_nonzero(buf[2:])
-        if non_zeros==0:
-            #buffer is empty
-            if not self.__panel_cleared[panel]:
-                #panel not empty yet, let's process this time
-                self.__panel_cleared[panel] = True
-            else:
-                #panel already cleared, stop now
-                return 0
-        else:
-            self.__panel_cleared[panel] = False
+        #preallocated buffers are shared, lock them during encoding too
+        with self.__lock:
+            #prepare buffers
+            bufs = self.__panels_buf
+            body = _encode_panels(pixels, bufs, self.__panels_scratch)
+            non_empty = body.any(axis=1)
+
+            for panel in range(self.__panel_count):
+                #check buffer
+                if not non_empty[panel]:
+                    #buffer is empty
+                    if not self.__panel_cleared[panel]:
+                        #panel not empty yet, let's process this time
+                        self.__panel_cleared[panel] = True
+                    else:
+                        #panel already cleared, skip it
+                        continue
+                else:
+                    self.__panel_cleared[panel] = False
 
-        #select panel to send command to
-        self.__lock.acquire(True)
-        self.__select_panel(panel)
+                #select panel to send command to
+                self.__select_panel(panel)
 
-        #write buffer and read result
-        res = self.__spi.writebytes(buf)
+                #write whole panel buffer in a single SPI transfer
+                #each panel has its own chip select (mux output) so a frame can't be sent in one transfer
+                if self.__spi_has_writebytes2:
+                    self.__spi.writebytes2(bufs[panel].tobytes())
+                else:
+                    self.__spi.writebytes(bufs[panel].tolist())
 
-        #unselect panel
-        self.__select_panel(None)
-        self.__lock.release()
-        
-        return res
+                #unselect panel
+                #panel is unselected between transfers: going through unselected state (A2 high)
+                #avoids briefly selecting another panel while mux pins are updated
+                self.__select_panel(None)
 
     def __write_pixels(self, pixels, index=0):
         """
@@ -660,95 +730,28 @@ class HT1632C():
         Buffer must be large enough for current board
 
         Args:
-            pixels: buffer of pixels
+            pixels: buffer of pixels. One uint8 per board column: the 8 pixels of a column are already packed as bits
             index: if buffer is too large, index can be used to get index of buffer to display.
                 If buffer is still too large, buffer is adjusted to board size.
 
         Raises:
             BufferInvalid
         """
+        board_size = self.__board_size
+
         #check size
-        if len(pixels)<self.__get_board_size():
+        if len(pixels)<board_size:
             #buffer is not large enough
-            raise InvalidBuffer(u'Buffer is not large enough (awaited size:%d, found size:%d)' % (self.__get_board_size(), len(pixels)))
-        if len(pixels)-index<self.__get_board_size():
+            raise InvalidBuffer(u'Buffer is not large enough (awaited size:%d, found size:%d)' % (board_size, len(pixels)))
+        if len(pixels)-index<board_size:
             raise InvalidBuffer(u'Buffer is too short if index applied. Please provide larger buffer')
 
-        #get only board size part of buffer
-        if index>0 or len(pixels)>self.__get_board_size():
-            pixels = pixels.tolist()[index: index+self.__get_board_size()]
-        else:
-            pixels = pixels.tolist()
-        
-        #display buffer on each panels
-        for panel in range(self.__panel_count):
-            #get pixels for current panel
-            panel_pixels = pixels[panel*32:panel*32+32]
-            #send pixels to current panel
-            self.__write_pixels_to_panel(panel, panel_pixels)
-
-    def __append_letter(self, buf, letter, position):
-        """
-        Append letter to specified buffer
-
-        Args:
-            buf: pixels buffer. can be None to compute buffer buffer length
-            letter: letter to write
-            position: current position in buffer
-
-        Returns:
-            int: new position in buffer
-        """
-        if letter!=PATTERN_REPLACEMENT:
-            try:
-                unicode_letter = letter.decode('utf-8')
-                font_letter = FONT5x7[ord(unicode_letter)]
-            except:
-                #invalid char
-                font_letter = FONT_INVALID
-            font_size = len(font_letter)
-            for col in range(font_size):
-                if buf is not None:
-                    buf[position] = font_letter[col]
-                position += 1
-        return position
-
-    def __append_logo(self, buf, logo, position):
-        """
-        Append logo to specified buffer
-
-        Args:
-            buf: pixels buffer. Can be None to compute buffer length
-            logo: logo to write
-            position: current position in buffer
-
-        Returns:
-            int: new position in buffer
-        """
-        font_size = len(LOGOS[logo])
-        for col in range(font_size):
-            if buf is not None:
-                buf[position] = LOGOS[logo][col]
-            position += 1
-        return position
-
-    def __append_text(self, buf, text, position):
-        """
-        Append text to specified buffer
-        
-        Args:
-            buf: pixels buffer. Can be None to compute buffer length
-            text: text to write
-            position: current position in buffer
+        #get only board size part of buffer (view, no copy) splitted by panel
+        #contiguous uint8 buffer (which is always the case for internal buffers) keeps encoder on its fast path
+        pixels = np.ascontiguousarray(pixels[index: index+board_size], dtype=np.uint8).reshape((self.__panel_count, 32))
 
-        Returns:
-            new position in buffer
-        """
-        self.logger.debug(u'append text %s @ %d' % (text, position))
-        text_size = len(text)
-        for col in range(text_size):
-            position = self.__append_letter(buf, text[col], position)
-        return position
+        #display buffer on all panels
+        self.__write_all_panels(pixels)
 
     def __get_board_size(self):
         """
@@ -757,11 +760,12 @@ class HT1632C():
         Returns:
             int: board size
         """
-        return self.__panel_count*32
+        return self.__board_size
 
     def __get_buffer(self, size=None):
         """
         Return empty buffer that fits current board size
+        Returned buffer is a view over a buffer allocated once and reused: it is only valid until next call
         
         Args:
             size: you can get custom buffer of specified size
@@ -772,16 +776,21 @@ class HT1632C():
         board_size = self.__get_board_size()
         if size is None:
             #no size specified, return board size buffer
-            return np.zeros((board_size,), dtype=np.uint8)
+            size = board_size
 
         elif size<board_size:
             #requested buffer size is not larger enought, return board size
             self.logger.debug(u'Requested size is not larger enough, return board size buffer')
-            return np.zeros((board_size,), dtype=np.uint8)
+            size = board_size
 
-        else:
-            #size is larger than board size, allocate buffer as requested
-            return np.zeros((size,), dtype=np.uint8)
+        if size>len(self.__frame_buf):
+            #buffer is too small, grow it (new buffer is already empty)
+            self.__frame_buf = np.zeros((size,), dtype=np.uint8)
+            return self.__frame_buf
+
+        buf = self.__frame_buf[:size]
+        buf.fill(0)
+        return buf
 
     def __human_readable_duration(self, timestamp):
         """
@@ -805,66 +814,91 @@ class HT1632C():
             message: input message
 
         Returns:
-            tuple: found_logos: dict of found logos (logo index:found logo string),
-                message: modified message (logo strings are replaced by constant PATTERN_REPLACEMENT),
+            tuple: found_patterns: list of found patterns (index, PATTERN_LOGO|PATTERN_TEXT, value) sorted by index,
+                message: modified message (pattern strings are replaced by constant PATTERN_REPLACEMENT,
+                    so message length is kept and patterns indexes match both input and modified messages),
                 evolutive: True if message contains evolutive fields (like time),
         """
-        found_patterns = {}
+        found_patterns = []
         evolutive = False
-
-        #search for logos
-        for logo in LOGOS:
-            pos = 0
-            while pos!=-1:
-                pos = message.find(logo)
-                if pos!=-1:
-                    #found logo
-                    message = message.replace(logo, PATTERN_REPLACEMENT*len(logo), 1)
-                    found_patterns[pos] = {u'type':u'logo', u'value':logo}
-        
-        #search for time pattern
         now_ts = time.time()
         now_dt = datetime.fromtimestamp(now_ts)
-        for match in list(re.finditer(u'(:time)(:[0-9]+)?', message)):
-            message = message.replace(match.group(0), PATTERN_REPLACEMENT*len(match.group(0)), 1)
-            evolutive = True
-            if match.group(2) is not None:
-                #timestamp specified, compute duration
-                ts = int(match.group(2)[1:])
-                if now_ts<=ts:
-                    found_patterns[match.start()] = {u'type':u'text', u'value':u'%s' % self.__human_readable_duration(ts-now_ts)}
-                else:
-                    #timestamp is behind now
-                    found_patterns[match.start()] = {u'type':u'text', u'value':u'[OVER]'}
+
+        #search for all patterns in a single pass, building message without patterns
+        chunks = []
+        last = 0
+        for match in PATTERN_RE.finditer(message):
+            if match.group(1) is not None:
+                #found logo
+                found_patterns.append((match.start(), PATTERN_LOGO, match.group(1)))
             else:
-                #only time tag specified, add current time
-                found_patterns[match.start()] = {u'type':u'text', u'value':u'%0.2d:%0.2d' % (now_dt.hour, now_dt.minute)}
+                #found time pattern
+                evolutive = True
+                if match.group(3) is not None:
+                    #timestamp specified, compute duration
+                    ts = int(match.group(3)[1:])
+                    if now_ts<=ts:
+                        found_patterns.append((match.start(), PATTERN_TEXT, u'%s' % self.__human_readable_duration(ts-now_ts)))
+                    else:
+                        #timestamp is behind now
+                        found_patterns.append((match.start(), PATTERN_TEXT, u'[OVER]'))
+                else:
+                    #only time tag specified, add current time
+                    found_patterns.append((match.start(), PATTERN_TEXT, u'%0.2d:%0.2d' % (now_dt.hour, now_dt.minute)))
+
+            chunks.append(message[last:match.start()])
+            chunks.append(PATTERN_REPLACEMENT*(match.end()-match.start()))
+            last = match.end()
+        chunks.append(message[last:])
+        message = ''.join(chunks)
 
         return found_patterns, message, evolutive
 
-    def __get_message_length(self, message, patterns):
+    def __rasterize_message(self, message, patterns):
         """
-        Compute message length
+        Rasterize message: plain text runs are rasterized in a single font table lookup,
+        patterns are rasterized separately
 
         Args:
-            message: message with logos replaced (see __search_for_patterns function)
-            logos: logos indexes
+            message: message with patterns replaced (see __search_for_patterns function)
+            patterns: found patterns (see __search_for_patterns function)
 
         Returns:
-            int: buffer position
+            numpy.ndarray: message pixels (uint8)
         """
-        buffer_position = 0
+        parts = []
+        start = 0
+        for index, kind, value in patterns:
+            parts.append(self.__rasterize_run(message[start:index]))
+            parts.append(PATTERN_RASTERIZERS[kind](value))
+            #remaining pattern chars are skipped during plain text rasterization
+            start = index + 1
+        parts.append(self.__rasterize_run(message[start:]))
+
+        return np.concatenate(parts)
+
+    def __rasterize_run(self, run):
+        """
+        Rasterize plain text run of message. Last rasterized runs are cached
+        because most of message content is the same from one display to another
 
-        for index in range(len(message)):
-            if index in patterns.keys():
-                if patterns[index][u'type']==u'logo':
-                    buffer_position = self.__append_logo(None, patterns[index][u'value'], buffer_position)
-                elif patterns[index][u'type']==u'text':
-                    buffer_position = self.__append_text(None, patterns[index][u'value'], buffer_position)
-            else:
-                buffer_position = self.__append_letter(None, message[index], buffer_position)
+        Args:
+            run: plain text run
+
+        Returns:
+            numpy.ndarray: run pixels (uint8). Must not be modified
+        """
+        pixels = self.__runs_cache.pop(run, None)
+        if pixels is None:
+            pixels = _rasterize_plain(run)
+            if len(self.__runs_cache)>=HT1632C.RUNS_CACHE_SIZE:
+                #drop least recently used run
+                self.__runs_cache.popitem(last=False)
+
+        #(re)insert run as most recently used one
+        self.__runs_cache[run] = pixels
 
-        return buffer_position
+        return pixels
 
     def clear(self):
         """
@@ -874,9 +908,7 @@ class HT1632C():
         self.__stop_scrolling_thread()
 
         #and display empty message
-        for panel in range(self.__panel_count):
-            #turn all leds on
-            self.__write_pixels_to_panel(panel, HT1632C.ALL_LEDS_OFF)
+        self.__write_pixels(self.__empty_board)
 
     def display_message(self, message, position=0):
         """
@@ -889,8 +921,48 @@ class HT1632C():
         Returns:
             bool: True if message is evolutive or False if board is off or message not evolutive
         """
-        buffer_position = 0
+        #drop message if board is off
+        if not self.__turned_on:
+            self.logger.debug(u'Board is turned off')
+            return False
+
+        pixels, evolutive = self.render_message(message)
+        self.display_pixels(pixels, position)
+
+        return evolutive
+
+    def render_message(self, message):
+        """
+        Render message pixels. Rendered pixels of not evolutive message can be displayed
+        again later using display_pixels function
+
+        Args:
+            message: message to render
+
+        Returns:
+            tuple: pixels (numpy.ndarray): message pixels,
+                evolutive (bool): True if message is evolutive (its pixels must be rendered again to be updated)
+        """
+        #decode message once for all
+        if isinstance(message, bytes):
+            message = message.decode('utf-8', 'replace')
 
+        #search for patterns in message
+        patterns, message, evolutive = self.__search_for_patterns(message)
+
+        return self.__rasterize_message(message, patterns), evolutive
+
+    def display_pixels(self, pixels, position=0):
+        """
+        Display rendered message pixels to board (see render_message function)
+
+        Args:
+            pixels (numpy.ndarray): message pixels
+            position: position of message in board (if message is too long it will be truncated)
+
+        Returns:
+            bool: True if pixels are displayed or False if board is off
+        """
         #auto reset hardware if needed
         self.__reset_hardware()
 
@@ -899,11 +971,8 @@ class HT1632C():
             self.logger.debug(u'Board is turned off')
             return False
 
-        #search for patterns in message
-        patterns, message, evolutive = self.__search_for_patterns(message)
-
         #get message length
-        message_length = self.__get_message_length(message, patterns)
+        message_length = len(pixels)
         self.logger.debug(u'message length=%d' % message_length)
 
         #stop existing scrolling thread
@@ -914,28 +983,15 @@ class HT1632C():
             #scroll message
             self.logger.debug(u'Add scrolling message')
 
-            #get buffer
-            buf = self.__get_buffer(self.__get_board_size() + message_length)
+            #get buffer (message is surrounded by empty board on both sides)
+            buf = self.__get_buffer(2*self.__get_board_size() + message_length)
 
             #fill buffer
-            buffer_position = 0
-            if self.direction==0:
-                buffer_index = message_length
-                buffer_position = 0
-            else:
-                buffer_index = 0
-                buffer_position = len(buf) - message_length
-            for index in range(len(message)):
-                if index in patterns.keys():
-                    if patterns[index][u'type']==u'logo':
-                        buffer_position = self.__append_logo(buf, patterns[index][u'value'], buffer_position)
-                    elif patterns[index][u'type']==u'text':
-                        buffer_position = self.__append_text(buf, patterns[index][u'value'], buffer_position)
-                else:
-                    buffer_position = self.__append_letter(buf, message[index], buffer_position)
+            buffer_position = self.__get_board_size()
+            buf[buffer_position:buffer_position+message_length] = pixels
 
             #launch scrolling thread
-            self.__scrolling_thread = ScrollingMessage(self.__get_board_size(), message_length, buf, buffer_index, self.direction, self.speed, self.__write_pixels, self.__reset_hardware)
+            self.__scrolling_thread = ScrollingMessage(self.__get_board_size(), buf, self.direction, self.speed, self.__write_pixels, self.__reset_hardware)
             self.__scrolling_thread.start()
 
         else:
@@ -943,26 +999,20 @@ class HT1632C():
             self.logger.debug(u'Add NOT scrolling  message')
 
             #get buffer
-            buf = self.__get_buffer(message_length)
+            buf = self.__get_buffer()
 
-            #fill buffer
-            #buf = self.__get_buffer(message_length)
-            for index in range(len(message)):
-                if index in patterns.keys():
-                    if patterns[index][u'type']==u'logo':
-                        buffer_position = self.__append_logo(buf, patterns[index][u'value'], buffer_position)
-                    elif patterns[index][u'type']==u'text':
-                        buffer_position = self.__append_text(buf, patterns[index][u'value'], buffer_position)
-                else:
-                    buffer_position = self.__append_letter(buf, message[index], buffer_position)
+            #fill buffer directly at specified position (message is truncated to board bounds)
+            if position<0:
+                pixels = pixels[-position:]
+                position = 0
+            end = min(position + len(pixels), len(buf))
+            if end>position:
+                buf[position:end] = pixels[:end-position]
 
-            #shift buffer if necessary
-            buf = shift(buf, position, cval=0)
-            
             #write buffer to panels
             self.__write_pixels(buf)
 
-        return evolutive
+        return True
 
     def scroll_message_once(self, message, speed=0.05, direction=0):
         """
@@ -982,15 +1032,28 @@ class HT1632C():
         if not self.__turned_on:
             return False
 
-        #search for logos in message
+        #decode message once for all
+        if isinstance(message, bytes):
+            message = message.decode('utf-8', 'replace')
+
+        #search for logos in message and render it
         patterns, message, evolutive = self.__search_for_patterns(message)
+        pixels = self.__rasterize_message(message, patterns)
 
         #get message length
-        message_length = self.__get_message_length(message, patterns)
+        message_length = len(pixels)
         self.logger.debug(u'message length=%d' % message_length)
 
+        #stop existing scrolling thread (it shares message buffer)
+        self.__stop_scrolling_thread()
+
+        #bind values used for each frame to locals
+        board_size = self.__get_board_size()
+        write_pixels = self.__write_pixels
+        sleep = time.sleep
+
         #fill buffer
-        buf = self.__get_buffer(self.__get_board_size() + message_length)
+        buf = self.__get_buffer(board_size + message_length)
         buffer_position = 0
         if direction==0:
             buffer_index = message_length
@@ -998,29 +1061,35 @@ class HT1632C():
         else:
             buffer_index = 0
             buffer_position = len(buf) - message_length
-        for index in range(len(message)):
-            if index in patterns.keys():
-                if patterns[index][u'type']==u'logo':
-                    buffer_position = self.__append_logo(buf, patterns[index][u'value'], buffer_position)
-                elif patterns[index][u'type']==u'text':
-                    buffer_position = self.__append_text(buf, patterns[index][u'value'], buffer_position)
-            else:
-                buffer_position = self.__append_letter(buf, message[index], buffer_position)
-        
+        buf[buffer_position:buffer_position+message_length] = pixels
+
         #scroll message
-        max_scrolling = self.__get_board_size() + message_length
+        #frames are paced on a deadline so rendering time is absorbed by the pause instead of slowing the scroll
+        max_scrolling = board_size + message_length
+        deadline = time.time()
         while max_scrolling>=0:
             #display message
-            self.__write_pixels(buf, buffer_index)
-            #shift buffer content
+            write_pixels(buf, buffer_index)
+            #shift buffer content (in place, integer shift filled with zeros)
             if direction==0:
-                buf = shift(buf, 1, cval=0)
+                buf[1:] = buf[:-1]
+                buf[0] = 0
             else:
-                buf = shift(buf, -1, cval=0)
+                buf[:-1] = buf[1:]
+                buf[-1] = 0
             #decrease number of scroll to process
             max_scrolling -= 1
-            #pause
-            time.sleep(speed)
+            #pause until next frame deadline
+            #time.time() is not monotonic (clock can be stepped by ntp): restart pacing from now if deadline
+            #is more than one frame away, so clock steps or late renders never freeze or burst the scroll
+            deadline += speed
+            now = time.time()
+            delay = deadline - now
+            if delay>speed or delay<-speed:
+                deadline = now + speed
+                delay = speed
+            if delay>0:
+                sleep(delay)
 
         return evolutive
  
@@ -1031,10 +1100,17 @@ class HT1632C():
         Args:
             duration: animation duration (in s)
         """
-        for i in range(int(float(duration)/float(speed))):
-            buf = np.random.randint(0, 255, self.__get_board_size())
-            self.__write_pixels(buf)
-            time.sleep(float(speed))
+        board_size = self.__get_board_size()
+        speed = float(speed)
+        write_pixels = self.__write_pixels
+        sleep = time.sleep
+        random_bytes = self.__random_state.bytes
+        buf = self.__random_buf
+        for i in range(int(duration/speed)):
+            #random bytes are random pixels columns (8 pixels per byte)
+            buf[:] = np.frombuffer(random_bytes(board_size), dtype=np.uint8)
+            write_pixels(buf)
+            sleep(speed)
 
     def display_animation(self):
        """
@@ -11,6 +11,8 @@ from raspiot.utils import InvalidParameter, MissingParameter
 from raspiot.profiles import DisplayLimitedTimeMessageProfile, DisplayAddOrReplaceMessageProfile
 import uuid
 import socket
+import heapq
+from threading import Lock
 
 __all__ = ['Messageboard']
 
@@ -24,6 +26,7 @@ class Message():
         self.end = end
         self.displayed_time = 0
         self.dynamic = False
+        self.rendered = None
         self.uuid = unicode(uuid.uuid4())
 
     def from_dict(self, message):
@@ -103,6 +106,11 @@ class Messageboard(RaspIotRenderer):
         #members
         self.__current_message = None
         self.messages = []
+        self.__messages_by_uuid = {}
+        self.__expiry_heap = []
+        self.__config_dirty = False
+        #messages are changed by both module commands and display task
+        self.__messages_lock = Lock()
 
         #init board
         pin_a0 = 15
@@ -111,6 +119,8 @@ class Messageboard(RaspIotRenderer):
         pin_e3 = 22
         panels = 4
         self.board = HT1632C(pin_a0, pin_a1, pin_a2, pin_e3, panels)
+        #rendered pixels can only be cached with driver that can render message without displaying it
+        self.__board_renders = hasattr(self.board, u'render_message')
         self.__set_board_units()
         self.board.set_scroll_speed(self.SPEEDS[self._get_config_field(u'speed')])
         self.__display_task = None
@@ -122,11 +132,15 @@ class Messageboard(RaspIotRenderer):
         """
         Configure module
         """
+        config = self._get_config()
+
         #load messages
-        for msg in self._get_config_field(u'messages'):
+        for msg in config[u'messages']:
             message = Message()
             message.from_dict(msg)
             self.messages.append(message)
+            self.__messages_by_uuid[message.uuid] = message
+            self.__push_expiry(message)
 
         #create device if necessary
         if self._get_device_count()==0:
@@ -137,7 +151,7 @@ class Messageboard(RaspIotRenderer):
             })
 
         #init display task
-        self.__display_task = BackgroundTask(self.__display_message, self.logger, float(self._get_config_field(u'duration')))
+        self.__display_task = BackgroundTask(self.__display_message, self.logger, float(config[u'duration']))
         self.__display_task.start()
 
         #display ip at startup during 1 minute
@@ -150,13 +164,70 @@ class Messageboard(RaspIotRenderer):
         """
         Stop module
         """
-        #clean board
-        self.board.cleanup()
-
         #stop task
         if self.__display_task:
             self.__display_task.stop()
 
+        #save pending messages changes (before board cleanup that may fail)
+        self.__flush_config()
+
+        #clean board
+        self.board.cleanup()
+
+    def __flush_config(self):
+        """
+        Save messages to config if they were modified since last save
+        """
+        with self.__messages_lock:
+            if not self.__config_dirty:
+                return
+            #clear flag with messages snapshot: messages changed during saving flag config again
+            self.__config_dirty = False
+            messages = [msg.to_dict() for msg in self.messages]
+
+        try:
+            self._set_config_field(u'messages', messages)
+        except:
+            #config not saved, keep it to save
+            self.__config_dirty = True
+            raise
+
+    def __push_expiry(self, msg):
+        """
+        Push message end in expiry heap. Must be called each time a message is added or its end is updated
+
+        Args:
+            msg (Message): message
+        """
+        heapq.heappush(self.__expiry_heap, (msg.end, msg.uuid))
+
+        if len(self.__expiry_heap)>2*len(self.messages)+16:
+            #too many outdated entries (replaced or deleted messages), rebuild heap
+            self.__expiry_heap = [(message.end, message.uuid) for message in self.messages]
+            heapq.heapify(self.__expiry_heap)
+
+    def __pop_obsolete_messages(self, now):
+        """
+        Pop obsolete messages from expiry heap
+
+        Args:
+            now (float): current timestamp
+
+        Returns:
+            set: uuids of obsolete messages
+        """
+        obsolete_uuids = set()
+        while len(self.__expiry_heap)>0 and self.__expiry_heap[0][0]<now:
+            end, msg_uuid = heapq.heappop(self.__expiry_heap)
+            msg = self.__messages_by_uuid.get(msg_uuid)
+            if msg is None or msg.end!=end:
+                #outdated entry, message was deleted or replaced
+                continue
+            self.logger.debug(u'Remove obsolete message %s', msg)
+            obsolete_uuids.add(msg_uuid)
+
+        return obsolete_uuids
+
     def __display_message(self):
         """
         Display messages. Called every seconds by task
@@ -164,47 +235,51 @@ class Messageboard(RaspIotRenderer):
         try:
             #now
             now = time.time()
-            self.logger.debug(u'__display_message at %d' % now)
+            #check log level once per tick to avoid formatting debug messages for nothing
+            debug = self.logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                self.logger.debug(u'__display_message at %d' % now)
+
+            #remove obsolete messages (config is saved at end of display)
+            with self.__messages_lock:
+                obsolete_uuids = self.__pop_obsolete_messages(now)
+                if len(obsolete_uuids)>0:
+                    self.messages[:] = [msg for msg in self.messages if msg.uuid not in obsolete_uuids]
+                    for obsolete_uuid in obsolete_uuids:
+                        self.__messages_by_uuid.pop(obsolete_uuid, None)
+                    self.__config_dirty = True
 
             #get messages to display
             messages_to_display = []
-            for msg in self.messages[:]:
+            for msg in self.messages:
                 if now>=msg.start and now<=msg.end:
                     #this message could be displayed
                     messages_to_display.append(msg)
 
-                elif now>msg.end:
-                    self.logger.debug(u'Remove obsolete message %s' % unicode(msg))
-                    #remove obsolete message from config
-                    config = self._get_config()
-                    messages = self._get_config_field(u'messages')
-                    for msg_conf in messages:
-                        if msg_conf[u'uuid']==msg.uuid:
-                            messages.remove(msg_conf)
-                            self._set_config_field(u'messages', messages)
-                            break
-
-                    #remove message internaly
-                    self.messages.remove(msg)
-
-            #sort messages to display by date
-            #msg's displayed_time is set when message is displayed
-            #message not displayed yet has displayed_time set to 0
-            #so naturally oldest messages or not already displayed are sorted at top of list
-            messages_to_display.sort(key=lambda msg:msg.displayed_time, reverse=False)
-
-            if self.logger.getEffectiveLevel()==logging.DEBUG:
+            if debug:
                 self.logger.debug(u'Messages to display:')
                 for msg in messages_to_display:
                     self.logger.debug(u' - %s' % unicode(msg))
 
-            #display first list message
+            #display oldest displayed message
             if len(messages_to_display)>0:
-                #get first list message
-                msg = messages_to_display[0]
+                #msg's displayed_time is set when message is displayed
+                #message not displayed yet has displayed_time set to 0
+                #so naturally oldest messages or not already displayed are picked first
+                #(first one in list order on equality)
+                msg = min(messages_to_display, key=lambda msg:msg.displayed_time)
                 if msg!=self.__current_message or msg.dynamic==True:
-                    self.logger.debug(u' ==> Display message %s' % unicode(msg))
-                    msg.dynamic = self.board.display_message(msg.message)
+                    if debug:
+                        self.logger.debug(u' ==> Display message %s' % unicode(msg))
+                    if not self.__board_renders:
+                        #older driver, render and display message at once
+                        msg.dynamic = self.board.display_message(msg.message)
+                    else:
+                        if msg.rendered is None or msg.rendered[1]:
+                            #render message (again if evolutive), otherwise reuse its pixels
+                            msg.rendered = self.board.render_message(msg.message)
+                        pixels, evolutive = msg.rendered
+                        msg.dynamic = self.board.display_pixels(pixels) and evolutive
                     msg.displayed_time = now
                     self.__current_message = msg
 
@@ -219,6 +294,12 @@ class Messageboard(RaspIotRenderer):
         except:
             self.logger.exception(u'Exception on message displaying:')
 
+        #save messages changes at once (even if board failed)
+        try:
+            self.__flush_config()
+        except:
+            self.logger.exception(u'Exception on messages saving:')
+
     def get_module_config(self):
         """
         Return module full configuration
@@ -294,13 +375,12 @@ class Messageboard(RaspIotRenderer):
         msg = Message(message, start, end)
         self.logger.debug(u'Add new message: %s' % unicode(msg))
 
-        #save it to config
-        messages = self._get_config_field(u'messages')
-        messages.append(msg.to_dict())
-        self._set_config_field(u'messages', messages)
-
-        #save it to internaly
-        self.messages.append(msg)
+        #save it internaly (config is saved on next display)
+        with self.__messages_lock:
+            self.messages.append(msg)
+            self.__messages_by_uuid[msg.uuid] = msg
+            self.__push_expiry(msg)
+            self.__config_dirty = True
         
         return msg.uuid
 
@@ -314,27 +394,17 @@ class Messageboard(RaspIotRenderer):
         Returns:
             bool: True if message deleted
         """
-        deleted = False
-
-        #delete message from config
-        messages = self._get_config_field(u'messages')
-        for msg in messages:
-            if msg[u'uuid']==uuid:
-                messages.remove(msg)
-                deleted = True
-                break
-        if deleted:
-            self._set_config_field(u'messages', messages)
-
-        #and delete it internaly
-        for msg in self.messages[:]:
-            if msg.uuid==uuid:
-                self.messages.remove(msg)
-                break
+        #delete message internaly (config is saved on next display)
+        with self.__messages_lock:
+            msg = self.__messages_by_uuid.pop(uuid, None)
+            if msg is None:
+                return False
 
+            self.messages.remove(msg)
+            self.__config_dirty = True
         self.logger.debug(u'Message "%s" deleted' % msg.message)
 
-        return deleted
+        return True
 
     def add_or_replace_message(self, message, uuid):
         """
@@ -349,50 +419,41 @@ class Messageboard(RaspIotRenderer):
             bool: True if message replaced
         """
         self.logger.debug(u'Replacing message uuid "%s" with message "%s"' % (uuid, message))
-        #replace message in config
+        #replace message internaly (config is saved on next display)
         replaced = False
-        messages = self._get_config_field(u'messages')
         start = int(time.time())
         end = start + 604800 #1 week
-        for msg in messages:
-            if msg[u'uuid']==uuid:
+        with self.__messages_lock:
+            msg = self.__messages_by_uuid.get(uuid)
+            if msg is not None:
                 #message found, replace infos by new ones
-                msg[u'message'] = message
-                msg[u'start'] = start
-                msg[u'end'] = end
+                msg.message = message
+                msg.start = start
+                msg.end = end
+                msg.rendered = None
                 replaced = True
-                break
 
-        if replaced:
-            #message found and replaced
-            self.logger.debug(u'Message replaced')
-            self._set_config_field(u'messages', messages)
+                #force message to be displayed again
+                self.__current_message = None
 
-            #replace message internaly
-            for msg in self.messages:
-                if msg.uuid==uuid:
-                    msg.message = message
-                    msg.start = start
-                    msg.end = end
+            if replaced:
+                #message found and replaced
+                self.logger.debug(u'Message replaced')
 
-                    #force message to be displayed again
-                    self.__current_message = None
+            else:
+                #message not found
+                self.logger.debug(u'Message added instead of replaced')
 
-        else:
-            #message not found
-            self.logger.debug(u'Message added instead of replaced')
-            
-            #create message object
-            msg = Message(message, start, end)
-            msg.uuid = uuid
-
-            #save it to config
-            messages = self._get_config_field(u'messages')
-            messages.append(msg.to_dict())
-            self._set_config_field(u'messages', messages)
+                #create message object
+                msg = Message(message, start, end)
+                msg.uuid = uuid
 
-            #save it to internaly
-            self.messages.append(msg)
+                #save it internaly
+                self.messages.append(msg)
+                self.__messages_by_uuid[msg.uuid] = msg
+
+            self.__push_expiry(msg)
+            self.__config_dirty = True
 
         return replaced
 
@@ -8,6 +8,9 @@ class TimeToDisplayAddOrReplaceMessageFormatter(Formatter):
     """
     Time data to DisplayAddOrReplaceProfile
     """
+
+    MESSAGE_FORMAT = u':clock: %02d:%02d %02d/%02d/%d'
+
     def __init__(self, events_broker):
         """
         Constuctor
@@ -24,7 +27,7 @@ class TimeToDisplayAddOrReplaceMessageFormatter(Formatter):
         profile.uuid = u'currenttime'
 
         #append current time
-        profile.message = u':clock: %02d:%02d %02d/%02d/%d' % (event_values[u'hour'], event_values[u'minute'], event_values[u'day'], event_values[u'month'], event_values[u'year'])
+        profile.message = self.MESSAGE_FORMAT % (event_values[u'hour'], event_values[u'minute'], event_values[u'day'], event_values[u'month'], event_values[u'year'])
 
         return profile
 